@@ -0,0 +1,11 @@
+-- liquibase formatted sql
+-- changeset joakim.akerstrom:2
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE messages
+    ADD COLUMN content_tsv TSVECTOR
+    GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED;
+
+CREATE INDEX idx_messages_content_tsv ON messages USING GIN (content_tsv);
+CREATE INDEX idx_messages_content_trgm ON messages USING GIN (content gin_trgm_ops);
@@ -0,0 +1,13 @@
+-- liquibase formatted sql
+-- changeset joakim.akerstrom:3
+
+CREATE TABLE message_counters (
+    username VARCHAR(32) PRIMARY KEY,
+    total BIGINT NOT NULL DEFAULT 0,
+    unread BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO message_counters (username, total, unread)
+SELECT username, COUNT(*), COUNT(*) FILTER (WHERE NOT is_read)
+FROM messages
+GROUP BY username;
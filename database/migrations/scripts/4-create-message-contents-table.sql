@@ -0,0 +1,26 @@
+-- liquibase formatted sql
+-- changeset joakim.akerstrom:4
+
+CREATE TABLE message_contents (
+    hash CHAR(64) PRIMARY KEY,
+    body TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    ref_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Bodies are stored as text and left to TOAST compression so that search
+-- can match substrings of compacted messages through this index.
+CREATE INDEX idx_message_contents_body_trgm ON message_contents
+    USING GIN (body gin_trgm_ops);
+
+ALTER TABLE messages ALTER COLUMN content DROP NOT NULL;
+ALTER TABLE messages ADD COLUMN content_hash CHAR(64) REFERENCES message_contents (hash);
+ALTER TABLE messages ADD CONSTRAINT chk_messages_content
+    CHECK ((content IS NULL) <> (content_hash IS NULL));
+
+-- Compacted bodies are not visible to a generated column, so the service
+-- now writes the search vector itself.
+ALTER TABLE messages ALTER COLUMN content_tsv DROP EXPRESSION;
+
+CREATE INDEX idx_messages_content_hash ON messages (content_hash);
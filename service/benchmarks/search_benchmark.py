@@ -0,0 +1,91 @@
+"""
+Measures search latency of MessageRepository.search_messages as the messages
+table grows. Run from the service directory against a throwaway database:
+
+    python -m benchmarks.search_benchmark 10000 100000 1000000
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+from sqlalchemy import text
+
+from source.repository import MessageRepository, TooManyMatchesError
+
+
+# Rare terms match a handful of rows anywhere in the table. Common terms match a
+# fifteenth of the table, so unscoped they exceed MAX_SEARCH_MATCHES and are
+# rejected, and scoped to one user they match a fifteenth of that user's rows.
+QUERIES = [
+    ("rare", "4711", None),
+    ("rare", "#4711", None),
+    ("common, one user", "invoice", "user7"),
+    ("common, one user", "quarterly report", "user7"),
+    ("common, rejected", "invoice", None),
+]
+SAMPLES = 20
+
+WORDS = (
+    "'invoice','quarterly','report','deploy','failed','meeting','lunch',"
+    "'release','ticket','urgent','weekly','sync','review','budget','travel'"
+)
+
+
+async def seed(repository: MessageRepository, rows: int) -> None:
+    async with repository._engine.begin() as conn:
+        await conn.execute(text("TRUNCATE messages RESTART IDENTITY"))
+        await conn.execute(
+            text(
+                f"""
+                INSERT INTO messages (username, content, content_tsv)
+                SELECT username, content, to_tsvector('simple', content)
+                FROM (
+                    SELECT 'user' || (i % 1000) AS username,
+                           (ARRAY[{WORDS}])[1 + i % 15] || ' '
+                           || (ARRAY[{WORDS}])[1 + (i / 15) % 15] || ' #' || i
+                           AS content
+                    FROM generate_series(1, :rows) AS i
+                ) AS seed
+                """
+            ),
+            {"rows": rows},
+        )
+        await conn.execute(text("ANALYZE messages"))
+
+
+async def measure(repository: MessageRepository, q: str, username) -> float:
+    query = {"username": username} if username else {}
+    timings = []
+    for _ in range(SAMPLES):
+        start = time.perf_counter()
+        try:
+            await repository.search_messages(q, 20, **query)
+        except TooManyMatchesError:
+            pass
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+async def main(sizes: list[int]) -> None:
+    repository = MessageRepository(
+        os.environ["MESSENGER_DB_HOST"],
+        int(os.environ["MESSENGER_DB_PORT"]),
+        os.environ["MESSENGER_DB_NAME"],
+        os.environ["MESSENGER_DB_USERNAME"],
+        os.environ["MESSENGER_DB_PASSWORD"],
+    )
+    repository._engine.echo = False
+
+    print(f"{'rows':>10} " + " ".join(f"{kind:>18}" for kind, _, _ in QUERIES))
+    print(f"{'':>10} " + " ".join(f"{q:>18}" for _, q, _ in QUERIES))
+    for rows in sizes:
+        await seed(repository, rows)
+        medians = [await measure(repository, q, u) for _, q, u in QUERIES]
+        print(f"{rows:>10} " + " ".join(f"{m:>15.2f} ms" for m in medians))
+
+
+if __name__ == "__main__":
+    asyncio.run(main([int(n) for n in sys.argv[1:]] or [10_000, 100_000, 1_000_000]))
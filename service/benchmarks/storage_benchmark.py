@@ -0,0 +1,97 @@
+"""
+Compares storage bytes, WAL volume and read latency of the inline message
+layout against compacted storage. Run from the service directory against a
+throwaway database, the messages tables are truncated between runs:
+
+    python -m benchmarks.storage_benchmark 5000
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+from sqlalchemy import text
+
+from source.repository import Message, MessageRepository
+
+
+THRESHOLD = 1024
+TEMPLATES = 50
+SAMPLES = 50
+
+
+def body(i: int) -> str:
+    header = f"Notification template {i % TEMPLATES}\n"
+    return header + "Your order has shipped and will arrive shortly. " * 100
+
+
+def repository(compaction_threshold) -> MessageRepository:
+    repo = MessageRepository(
+        os.environ["MESSENGER_DB_HOST"],
+        int(os.environ["MESSENGER_DB_PORT"]),
+        os.environ["MESSENGER_DB_NAME"],
+        os.environ["MESSENGER_DB_USERNAME"],
+        os.environ["MESSENGER_DB_PASSWORD"],
+        compaction_threshold=compaction_threshold,
+    )
+    repo._engine.echo = False
+    return repo
+
+
+async def scalar(repo: MessageRepository, sql: str):
+    async with repo._engine.connect() as conn:
+        return (await conn.execute(text(sql))).scalar_one()
+
+
+async def run(repo: MessageRepository, rows: int) -> dict:
+    async with repo._engine.begin() as conn:
+        await conn.execute(
+            text(
+                "TRUNCATE messages, message_contents, message_counters RESTART IDENTITY"
+            )
+        )
+    wal_start = await scalar(repo, "SELECT pg_current_wal_lsn()::text")
+    for i in range(rows):
+        await repo.create_message(Message(f"user{i % 100}", body(i)))
+    wal_bytes = await scalar(
+        repo, f"SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), '{wal_start}')"
+    )
+    storage_bytes = await scalar(
+        repo,
+        "SELECT pg_total_relation_size('messages')"
+        " + pg_total_relation_size('message_contents')",
+    )
+
+    page_timings, single_timings = [], []
+    for i in range(SAMPLES):
+        start = time.perf_counter()
+        await repo.get_messages(0, 100)
+        page_timings.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        await repo.get_message_by_id(1 + i * rows // SAMPLES)
+        single_timings.append(time.perf_counter() - start)
+
+    return {
+        "storage_mb": storage_bytes / 2**20,
+        "wal_mb": float(wal_bytes) / 2**20,
+        "page_ms": statistics.median(page_timings) * 1000,
+        "single_ms": statistics.median(single_timings) * 1000,
+    }
+
+
+async def main(rows: int) -> None:
+    print(
+        f"{'layout':>10} {'storage':>12} {'wal':>12} {'page of 100':>14} {'by id':>10}"
+    )
+    for name, threshold in [("inline", None), ("compacted", THRESHOLD)]:
+        result = await run(repository(threshold), rows)
+        print(
+            f"{name:>10} {result['storage_mb']:>9.2f} MB {result['wal_mb']:>9.2f} MB "
+            f"{result['page_ms']:>11.2f} ms {result['single_ms']:>7.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000))
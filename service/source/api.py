@@ -1,15 +1,39 @@
+import base64
+import csv
+import io
+import json
 import os
 import uuid
-from datetime import datetime
-from typing import Optional
-
-from fastapi import FastAPI, HTTPException, status, Query, Request, Header
-from fastapi.responses import JSONResponse
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import AsyncIterator, Optional
+from urllib.parse import quote
+
+from fastapi import (
+    Depends,
+    FastAPI,
+    HTTPException,
+    status,
+    Query,
+    Request,
+    Response,
+    Header,
+)
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
+from starlette.types import Receive, Scope, Send
 
 from .util.logging import global_logger as log
+from .util.admission import ConcurrencyLimiter, OverloadedError
+from .util.deadline import DeadlineExceededError, deadline
+from .util.rate_limit import (
+    InMemoryBucketStore,
+    RateLimitedError,
+    RateLimiter,
+    RedisBucketStore,
+)
 from .util.idempotency import ExecutionStatus, execute
-from .repository import MessageRepository, Message
+from .repository import MessageRepository, Message, TooManyMatchesError
 
 
 message_repository = MessageRepository(
@@ -18,7 +42,96 @@ message_repository = MessageRepository(
     os.environ["MESSENGER_DB_NAME"],
     os.environ["MESSENGER_DB_USERNAME"],
     os.environ["MESSENGER_DB_PASSWORD"],
+    compaction_threshold=(
+        int(os.environ["MESSENGER_CONTENT_COMPACTION_THRESHOLD"])
+        if os.environ.get("MESSENGER_CONTENT_COMPACTION_THRESHOLD")
+        else None
+    ),
+)
+
+# The default pool holds 15 connections (5 + 10 overflow), so the limits below
+# are sized to keep every admitted request from waiting on the pool.
+read_limiter = ConcurrencyLimiter(
+    "read", limit=8, queue_size=32, queue_timeout=1.0, request_timeout=5.0
+)
+write_limiter = ConcurrencyLimiter(
+    "write", limit=5, queue_size=16, queue_timeout=1.0, request_timeout=5.0
+)
+export_limiter = ConcurrencyLimiter(
+    "export",
+    limit=2,
+    queue_size=0,
+    queue_timeout=0.0,
+    request_timeout=None,
+    retry_after=30,
+)
+limiters = [read_limiter, write_limiter, export_limiter]
+# Exports legitimately hold their slots for minutes, so only the read and write
+# limiters decide whether the instance reports itself as saturated.
+health_limiters = [read_limiter, write_limiter]
+
+# Message ids are allocated at INSERT, not at commit, so the newest ids may still
+# be invisible to an export. Exports stop at a message created at least this long
+# ago, which is well past the write deadline of any transaction still holding a
+# lower id.
+EXPORT_LAG = timedelta(seconds=60)
+
+if os.environ.get("MESSENGER_RATE_LIMIT_REDIS_URL"):
+    rate_limit_store = RedisBucketStore.from_url(
+        os.environ["MESSENGER_RATE_LIMIT_REDIS_URL"]
+    )
+else:
+    rate_limit_store = InMemoryBucketStore(max_buckets=100_000)
+create_user_rate_limiter = RateLimiter(
+    "create_user", rate=10, capacity=20, store=rate_limit_store
+)
+create_client_rate_limiter = RateLimiter(
+    "create_client", rate=50, capacity=100, store=rate_limit_store
 )
+delete_client_rate_limiter = RateLimiter(
+    "delete_client", rate=20, capacity=100, store=rate_limit_store
+)
+
+
+def admit(limiter: ConcurrencyLimiter):
+    async def dependency(
+        request_timeout_ms: Optional[int] = Header(
+            None, alias="X-Request-Timeout-Ms", gt=0
+        ),
+    ):
+        timeout = limiter.request_timeout
+        if request_timeout_ms is not None:
+            timeout = request_timeout_ms / 1000
+            if limiter.request_timeout is not None:
+                timeout = min(timeout, limiter.request_timeout)
+        with deadline(timeout):
+            async with limiter.admit():
+                yield
+
+    return dependency
+
+
+def throttle(limiter: RateLimiter):
+    async def dependency(request: Request):
+        await limiter.check(_client_key(request))
+
+    return dependency
+
+
+async def throttle_batch_delete(request: Request, message_ids: list[int] = Query(...)):
+    await delete_client_rate_limiter.check(_client_key(request), len(message_ids))
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    def __init__(self, limiter: ConcurrencyLimiter, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._limiter = limiter
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._limiter.release()
 
 
 class MessageResponse(BaseModel):
@@ -37,11 +150,32 @@ class PaginatedMessageResponse(BaseModel):
     page_size: int
 
 
+class SearchMessageResponse(BaseModel):
+    messages: list[MessageResponse]
+    next_cursor: Optional[str]
+    page_size: int
+
+
+class MessageCountsResponse(BaseModel):
+    username: str
+    total: int
+    unread: int
+
+
+class ExportFormat(str, Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+
 class MessageRequest(BaseModel):
     username: str
     content: str
 
 
+async def throttle_username(message_request: MessageRequest):
+    await create_user_rate_limiter.check(message_request.username)
+
+
 class MessagesDeleteResponse(BaseModel):
     deleted: list[int]
     not_deleted: list[int]
@@ -79,15 +213,163 @@ async def global_exception_handler(req: Request, e: Exception):
     return JSONResponse(status_code=422, content={"detail": "Bad request"})
 
 
+@app.exception_handler(OverloadedError)
+async def overloaded_exception_handler(req: Request, e: OverloadedError):
+    log.warn(
+        "Rejected request due to overload",
+        method=req.method,
+        request=str(req.url),
+        error=str(e),
+    )
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Service overloaded"},
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+@app.exception_handler(RateLimitedError)
+async def rate_limited_exception_handler(req: Request, e: RateLimitedError):
+    log.warn(
+        "Rejected request due to rate limit",
+        method=req.method,
+        request=str(req.url),
+        error=str(e),
+    )
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Too many requests"},
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+@app.exception_handler(DeadlineExceededError)
+async def deadline_exception_handler(req: Request, e: DeadlineExceededError):
+    log.warn(
+        "Request deadline exceeded",
+        method=req.method,
+        request=str(req.url),
+        error=str(e),
+    )
+    return JSONResponse(status_code=504, content={"detail": "Request timed out"})
+
+
 @app.get("/health", status_code=status.HTTP_200_OK)
-async def check_health():
+async def check_health(response: Response):
     log.info("Checking health")
+    saturated = any(limiter.saturated for limiter in health_limiters)
+    if saturated:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return {
+        "status": "saturated" if saturated else "ok",
+        "limiters": {limiter.name: limiter.stats() for limiter in limiters},
+        "pool": message_repository.pool_stats(),
+    }
+
+
+@app.get(
+    "/message/search",
+    response_model=SearchMessageResponse,
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(admit(read_limiter))],
+)
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=256),
+    include_read: bool = True,
+    username: Optional[str] = None,
+    cursor: Optional[str] = None,
+    size: int = Query(20, ge=1, le=100),
+):
+    log.info("Received request to search messages", q=q, username=username)
+    query = {}
+    if username:
+        query["username"] = username
+    if not include_read:
+        query["is_read"] = False
+
+    after = _decode_cursor(cursor) if cursor else None
+    try:
+        results = await message_repository.search_messages(q, size, after, **query)
+    except TooManyMatchesError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"{e.message}; refine the query or filter by username",
+        ) from e
+    next_cursor = None
+    if len(results) == size:
+        last_message, last_rank = results[-1]
+        next_cursor = _encode_cursor(last_rank, last_message.id)
+
+    return SearchMessageResponse(
+        messages=[
+            MessageResponse(
+                message_id=m.id,
+                username=m.username,
+                content=m.content,
+                created_at=m.created_at,
+                is_read=m.is_read,
+            )
+            for m, _ in results
+        ],
+        next_cursor=next_cursor,
+        page_size=size,
+    )
+
+
+@app.get("/message/export", status_code=status.HTTP_200_OK)
+async def export_messages(
+    username: str,
+    include_read: bool = True,
+    after_id: Optional[int] = Query(
+        None,
+        ge=0,
+        description="Resume after the last exported message_id. Replaces a "
+        "created_at based `since` bound, which dropped rows sharing a timestamp.",
+    ),
+    export_format: ExportFormat = Query(ExportFormat.NDJSON, alias="format"),
+):
+    log.info(
+        "Received request to export messages",
+        username=username,
+        after_id=after_id,
+        format=export_format.value,
+    )
+    query = {"username": username}
+    if not include_read:
+        query["is_read"] = False
+
+    await export_limiter.acquire()
+    try:
+        until_id = await message_repository.latest_message_id_before(
+            datetime.now() - EXPORT_LAG
+        )
+    except Exception:
+        export_limiter.release()
+        raise
+    until_id = until_id or 0
+    messages = message_repository.stream_messages(after_id, until_id, **query)
+    headers = {"X-Export-Until-Id": str(until_id)}
+    if export_format is ExportFormat.CSV:
+        headers["Content-Disposition"] = _attachment(f"{username}.csv")
+        return AdmittedStreamingResponse(
+            export_limiter,
+            _encode_csv(messages),
+            media_type="text/csv",
+            headers=headers,
+        )
+    return AdmittedStreamingResponse(
+        export_limiter,
+        _encode_ndjson(messages),
+        media_type="application/x-ndjson",
+        headers=headers,
+    )
 
 
 @app.get(
     "/message/{message_id}",
     response_model=MessageResponse,
     status_code=status.HTTP_200_OK,
+    dependencies=[Depends(admit(read_limiter))],
 )
 async def get_message(message_id: int):
     log.info("Received request to get message", message_id=message_id)
@@ -108,7 +390,10 @@ async def get_message(message_id: int):
 
 
 @app.get(
-    "/message/", response_model=PaginatedMessageResponse, status_code=status.HTTP_200_OK
+    "/message/",
+    response_model=PaginatedMessageResponse,
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(admit(read_limiter))],
 )
 async def get_messages(
     include_read: bool = True,
@@ -146,8 +431,31 @@ async def get_messages(
     )
 
 
+@app.get(
+    "/user/{username}/counts",
+    response_model=MessageCountsResponse,
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(admit(read_limiter))],
+)
+async def get_message_counts(username: str):
+    log.info("Received request to get message counts", username=username)
+    counter = await message_repository.get_message_counts(username)
+    if counter:
+        return MessageCountsResponse(
+            username=username, total=counter.total, unread=counter.unread
+        )
+    return MessageCountsResponse(username=username, total=0, unread=0)
+
+
 @app.post(
-    "/message/", response_model=MessageResponse, status_code=status.HTTP_201_CREATED
+    "/message/",
+    response_model=MessageResponse,
+    status_code=status.HTTP_201_CREATED,
+    dependencies=[
+        Depends(throttle(create_client_rate_limiter)),
+        Depends(throttle_username),
+        Depends(admit(write_limiter)),
+    ],
 )
 async def post_message(
     message_request: MessageRequest,
@@ -189,6 +497,7 @@ async def post_message(
     "/message/{message_id}/read",
     response_model=MessageResponse,
     status_code=status.HTTP_200_OK,
+    dependencies=[Depends(admit(write_limiter))],
 )
 async def put_message_read(message_id: int):
     log.info("Received request to mark a message as read", message_id=message_id)
@@ -207,7 +516,14 @@ async def put_message_read(message_id: int):
         )
 
 
-@app.delete("/message/{id}", status_code=status.HTTP_204_NO_CONTENT)
+@app.delete(
+    "/message/{id}",
+    status_code=status.HTTP_204_NO_CONTENT,
+    dependencies=[
+        Depends(throttle(delete_client_rate_limiter)),
+        Depends(admit(write_limiter)),
+    ],
+)
 async def delete_message(message_id: int):
     log.info("Received request to delete a message", message_id=message_id)
     success = await message_repository.delete_message(message_id)
@@ -219,6 +535,10 @@ async def delete_message(message_id: int):
     "/message/",
     response_model=MessagesDeleteResponse,
     status_code=status.HTTP_207_MULTI_STATUS,
+    dependencies=[
+        Depends(throttle_batch_delete),
+        Depends(admit(write_limiter)),
+    ],
 )
 async def delete_messages(message_ids: list[int] = Query(...)):
     log.info("Received request to delete multiple messages", message_ids=message_ids)
@@ -231,3 +551,63 @@ async def delete_messages(message_ids: list[int] = Query(...)):
             payload["not_deleted"] = i
             log.error("Failed to delete message", message_id=i)
     return MessagesDeleteResponse(**payload)
+
+
+def _encode_cursor(rank: float, message_id: int) -> str:
+    payload = json.dumps([rank, message_id]).encode()
+    return base64.urlsafe_b64encode(payload).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[float, int]:
+    try:
+        rank, message_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(rank), int(message_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Malformed search cursor") from e
+
+
+_EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+def _to_response(message: Message) -> MessageResponse:
+    return MessageResponse(
+        message_id=message.id,
+        username=message.username,
+        content=message.content,
+        is_read=message.is_read,
+        created_at=message.created_at,
+    )
+
+
+async def _encode_ndjson(messages: AsyncIterator[Message]) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    async for message in messages:
+        buffer.write(_to_response(message).model_dump_json())
+        buffer.write("\n")
+        if buffer.tell() >= _EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+async def _encode_csv(messages: AsyncIterator[Message]) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(MessageResponse.model_fields.keys())
+    async for message in messages:
+        writer.writerow(_to_response(message).model_dump(mode="json").values())
+        if buffer.tell() >= _EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _attachment(filename: str) -> str:
+    encoded = quote(filename, safe="")
+    return f"attachment; filename=\"export.csv\"; filename*=UTF-8''{encoded}"
+
+
+def _client_key(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
@@ -1,2 +1,8 @@
 from .response_repository import ResponseRepository, Response, Status, ConflictError
-from .message_repository import MessageRepository, Message
\ No newline at end of file
+from .message_repository import (
+    MessageRepository,
+    Message,
+    MessageContent,
+    MessageCounter,
+    TooManyMatchesError,
+)
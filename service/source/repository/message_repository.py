@@ -1,12 +1,37 @@
+import contextlib
 import datetime
-from typing import Optional, List
+import hashlib
+from typing import AsyncIterator, Optional, List, Tuple
 from urllib.parse import quote_plus
 
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, func
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    Boolean,
+    DateTime,
+    cast,
+    delete,
+    func,
+    or_,
+    tuple_,
+    union,
+    update,
+)
+from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION, TSVECTOR, BIGINT, insert
 from sqlalchemy.exc import DataError, DatabaseError
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.future import select
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from sqlalchemy.orm import sessionmaker, deferred, DeclarativeBase
+from sqlalchemy.orm.attributes import set_committed_value
+
+from ..util.deadline import DeadlineExceededError, remaining
+
+
+class TooManyMatchesError(Exception):
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
 
 
 class Base(DeclarativeBase):
@@ -18,9 +43,11 @@ class Message(Base):
 
     id = Column(Integer, primary_key=True)
     username = Column(String, nullable=False)
-    content = Column(String, nullable=False)
+    content = Column(String, nullable=True)
+    content_hash = Column(String, nullable=True)
     created_at = Column(DateTime, default=func.now())
     is_read = Column(Boolean, default=False)
+    content_tsv = deferred(Column(TSVECTOR))
 
     def __init__(self, username: str, content: str):
         super().__init__()
@@ -40,31 +67,85 @@ class Message(Base):
         return [column.name for column in cls.__table__.columns]
 
 
+class MessageCounter(Base):
+    __tablename__ = "message_counters"
+
+    username = Column(String, primary_key=True)
+    total = Column(BIGINT, nullable=False, default=0)
+    unread = Column(BIGINT, nullable=False, default=0)
+
+    def __repr__(self):
+        return (
+            f"MessageCounter(username={self.username}, total={self.total}, "
+            f"unread={self.unread})"
+        )
+
+
+class MessageContent(Base):
+    __tablename__ = "message_contents"
+
+    hash = Column(String, primary_key=True)
+    body = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, server_default=func.now())
+
+    def __repr__(self):
+        return (
+            f"MessageContent(hash={self.hash}, size={self.size}, "
+            f"ref_count={self.ref_count})"
+        )
+
+
 class MessageRepository:
-    def __init__(self, db_host: str, db_port: int, db_name: str, db_username: str, db_password: str):
+    _MIN_SUBSTRING_QUERY = 3
+    MAX_SEARCH_MATCHES = 10_000
+
+    def __init__(
+        self,
+        db_host: str,
+        db_port: int,
+        db_name: str,
+        db_username: str,
+        db_password: str,
+        compaction_threshold: Optional[int] = None,
+    ):
         self._db_url = self._connection_string(
             "postgresql+asyncpg", db_host, db_port, db_name, db_username, db_password
         )
+        self._compaction_threshold = compaction_threshold
         self._engine = create_async_engine(self._db_url, echo=True)
         self._sessionmaker = sessionmaker(
             bind=self._engine, class_=AsyncSession, expire_on_commit=False
         )
 
     async def count_messages(self, **kwargs) -> int:
-        async with self._sessionmaker() as session:
+        async with self._session() as session:
+            if self._is_counter_query(kwargs):
+                counter = await session.get(MessageCounter, kwargs["username"])
+                if not counter:
+                    return 0
+                return counter.unread if "is_read" in kwargs else counter.total
             query = select(func.count(Message.id))
             if kwargs:
                 query = query.filter_by(**kwargs)
             result = await session.execute(query)
             return result.scalar_one()
 
+    async def get_message_counts(self, username: str) -> Optional[MessageCounter]:
+        async with self._session() as session:
+            return await session.get(MessageCounter, username)
+
     async def get_message_by_id(self, message_id: int) -> Optional[Message]:
-        async with self._sessionmaker() as session:
+        async with self._session() as session:
             result = await session.execute(select(Message).filter_by(id=message_id))
-            return result.scalars().first()
+            message = result.scalars().first()
+            if message:
+                await self._hydrate(session, [message])
+            return message
 
     async def get_messages(self, i: int, j: int, **kwargs) -> List[Message]:
-        async with self._sessionmaker() as session:
+        async with self._session() as session:
             query = (
                 select(Message)
                 .order_by(Message.created_at.desc())
@@ -74,14 +155,122 @@ class MessageRepository:
             if kwargs:
                 query = query.filter_by(**kwargs)
             result = await session.execute(query)
-            return result.scalars().all()
+            messages = result.scalars().all()
+            await self._hydrate(session, messages)
+            return messages
+
+    async def search_messages(
+        self,
+        q: str,
+        limit: int,
+        after: Optional[Tuple[float, int]] = None,
+        **kwargs,
+    ) -> List[Tuple[Message, float]]:
+        async with self._session() as session:
+            ts_query = func.websearch_to_tsquery("simple", q)
+            match = Message.content_tsv.op("@@")(ts_query)
+            rank = func.ts_rank(Message.content_tsv, ts_query)
+            compacted = None
+            # pg_trgm indexes cannot serve patterns shorter than a trigram, so
+            # short queries only use the full-text index.
+            if len(q) >= self._MIN_SUBSTRING_QUERY:
+                match = or_(match, Message.content.icontains(q, autoescape=True))
+                # Compacted bodies are matched through the trigram index on
+                # message_contents and joined back by hash.
+                compacted = (
+                    select(Message.id)
+                    .filter_by(**kwargs)
+                    .join(MessageContent, MessageContent.hash == Message.content_hash)
+                    .filter(MessageContent.body.icontains(q, autoescape=True))
+                )
+                content = func.coalesce(Message.content, MessageContent.body)
+                rank = rank + func.coalesce(func.word_similarity(q, content), 0)
+            rank = cast(rank, DOUBLE_PRECISION)
+
+            # Every match is ranked, so pages are complete and stable, but the
+            # match set is capped: the candidate scan stops one row past the
+            # cap and broader queries are rejected instead of ranked.
+            candidates = select(Message.id).filter(match).filter_by(**kwargs)
+            if compacted is not None:
+                candidates = union(candidates, compacted)
+            candidates = candidates.limit(self.MAX_SEARCH_MATCHES + 1).cte("candidates")
+            matches = select(func.count()).select_from(candidates).scalar_subquery()
+            query = (
+                select(Message, rank, matches)
+                .join(candidates, Message.id == candidates.c.id)
+                .order_by(rank.desc(), Message.id.desc())
+                .limit(limit)
+            )
+            if compacted is not None:
+                query = query.outerjoin(
+                    MessageContent, MessageContent.hash == Message.content_hash
+                )
+            if after:
+                query = query.filter(tuple_(rank, Message.id) < tuple_(*after))
+            result = await session.execute(query)
+            rows = result.all()
+            if rows and rows[0][2] > self.MAX_SEARCH_MATCHES:
+                raise TooManyMatchesError(
+                    f"Search matched more than {self.MAX_SEARCH_MATCHES} messages"
+                )
+            results = [(message, r) for message, r, _ in rows]
+            await self._hydrate(session, [message for message, _ in results])
+            return results
+
+    async def latest_message_id_before(
+        self, cutoff: datetime.datetime
+    ) -> Optional[int]:
+        async with self._session() as session:
+            result = await session.execute(
+                select(Message.id)
+                .filter(Message.created_at < cutoff)
+                .order_by(Message.created_at.desc())
+                .limit(1)
+            )
+            return result.scalar_one_or_none()
+
+    async def stream_messages(
+        self,
+        after_id: Optional[int] = None,
+        until_id: Optional[int] = None,
+        batch_size: int = 500,
+        **kwargs,
+    ) -> AsyncIterator[Message]:
+        async with self._session() as session:
+            query = (
+                select(Message)
+                .order_by(Message.id)
+                .execution_options(yield_per=batch_size)
+            )
+            if after_id is not None:
+                query = query.filter(Message.id > after_id)
+            if until_id is not None:
+                query = query.filter(Message.id <= until_id)
+            if kwargs:
+                query = query.filter_by(**kwargs)
+            result = await session.stream_scalars(query)
+            async for partition in result.partitions():
+                await self._hydrate(session, partition)
+                for message in partition:
+                    yield message
 
     async def create_message(self, message: Message) -> Message:
-        async with self._sessionmaker() as session:
+        async with self._session() as session:
             try:
+                content = message.content
+                message.content_tsv = func.to_tsvector("simple", content)
+                # Writes lock messages, then message_counters, then
+                # message_contents, so concurrent writers cannot deadlock.
+                await self._adjust_counters(
+                    session, message.username, 1, self._unread(message.is_read)
+                )
+                if self._should_compact(content):
+                    await self._store_content(session, message, content)
                 session.add(message)
-                await session.commit()
+                await session.flush()
                 await session.refresh(message)
+                await session.commit()
+                set_committed_value(message, "content", content)
                 return message
             except DataError as e:
                 await session.rollback()
@@ -91,16 +280,36 @@ class MessageRepository:
                 raise RuntimeError("Failed to create a message") from e
 
     async def update_message(self, message_id: int, **kwargs) -> Optional[Message]:
-        async with self._sessionmaker() as session:
+        async with self._session() as session:
             try:
-                message = await session.get(Message, message_id)
+                message = await session.get(Message, message_id, with_for_update=True)
                 if message:
+                    username, is_read = message.username, message.is_read
                     for k, v in kwargs.items():
                         if k not in Message.columns():
                             raise AttributeError(f"Attribute {k} does not exist on Message")
-                        setattr(message, k, v)
-                    await session.commit()
+                        if k != "content":
+                            setattr(message, k, v)
+                    if username != message.username:
+                        await self._adjust_counters(
+                            session, username, -1, -self._unread(is_read)
+                        )
+                        await self._adjust_counters(
+                            session, message.username, 1, self._unread(message.is_read)
+                        )
+                    elif is_read != message.is_read:
+                        await self._adjust_counters(
+                            session,
+                            username,
+                            0,
+                            self._unread(message.is_read) - self._unread(is_read),
+                        )
+                    if "content" in kwargs:
+                        await self._replace_content(session, message, kwargs["content"])
+                    await session.flush()
                     await session.refresh(message)
+                    await self._hydrate(session, [message])
+                    await session.commit()
                     return message
                 return None
             except (AttributeError, DataError) as e:
@@ -111,11 +320,16 @@ class MessageRepository:
                 raise RuntimeError("Failed to update a message") from e
 
     async def delete_message(self, message_id: int) -> bool:
-        async with self._sessionmaker() as session:
+        async with self._session() as session:
             try:
-                message = await session.get(Message, message_id)
+                message = await session.get(Message, message_id, with_for_update=True)
                 if message:
+                    await self._adjust_counters(
+                        session, message.username, -1, -self._unread(message.is_read)
+                    )
                     await session.delete(message)
+                    if message.content_hash:
+                        await self._release_content(session, message.content_hash)
                     await session.commit()
                     return True
                 return False
@@ -123,6 +337,144 @@ class MessageRepository:
                 await session.rollback()
                 raise RuntimeError("Failed to delete message") from e
 
+    def pool_stats(self) -> dict:
+        pool = self._engine.pool
+        return {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+        }
+
+    @contextlib.asynccontextmanager
+    async def _session(self) -> AsyncIterator[AsyncSession]:
+        async with self._sessionmaker() as session:
+            time_left = remaining()
+            if time_left is not None:
+                if time_left <= 0:
+                    raise DeadlineExceededError("Request deadline exceeded")
+                timeout_ms = max(int(time_left * 1000), 1)
+                await session.execute(
+                    select(
+                        func.set_config("statement_timeout", f"{timeout_ms}ms", True)
+                    )
+                )
+            try:
+                yield session
+            except Exception as e:
+                if self._is_statement_timeout(e):
+                    raise DeadlineExceededError("Request deadline exceeded") from e
+                raise
+
+    @staticmethod
+    def _is_statement_timeout(e: Optional[BaseException]) -> bool:
+        while e is not None:
+            if getattr(getattr(e, "orig", None), "sqlstate", None) == "57014":
+                return True
+            e = e.__cause__
+        return False
+
+    def _should_compact(self, content: str) -> bool:
+        return (
+            self._compaction_threshold is not None
+            and len(content) >= self._compaction_threshold
+        )
+
+    async def _replace_content(
+        self, session: AsyncSession, message: Message, content: str
+    ) -> None:
+        previous_hash = message.content_hash
+        message.content = content
+        message.content_hash = None
+        message.content_tsv = func.to_tsvector("simple", content)
+        if self._should_compact(content):
+            await self._store_content(session, message, content)
+        if previous_hash:
+            await self._release_content(session, previous_hash)
+
+    @staticmethod
+    async def _store_content(
+        session: AsyncSession, message: Message, content: str
+    ) -> None:
+        data = content.encode()
+        digest = hashlib.sha256(data).hexdigest()
+        result = await session.execute(
+            update(MessageContent)
+            .where(MessageContent.hash == digest)
+            .values(ref_count=MessageContent.ref_count + 1)
+            .returning(MessageContent.hash)
+            .execution_options(synchronize_session=False)
+        )
+        if result.first() is None:
+            statement = insert(MessageContent).values(
+                hash=digest, body=content, size=len(data), ref_count=1
+            )
+            statement = statement.on_conflict_do_update(
+                index_elements=[MessageContent.hash],
+                set_={"ref_count": MessageContent.ref_count + 1},
+            )
+            await session.execute(statement)
+        message.content = None
+        message.content_hash = digest
+
+    @staticmethod
+    async def _release_content(session: AsyncSession, digest: str) -> None:
+        result = await session.execute(
+            update(MessageContent)
+            .where(MessageContent.hash == digest)
+            .values(ref_count=MessageContent.ref_count - 1)
+            .returning(MessageContent.ref_count)
+            .execution_options(synchronize_session=False)
+        )
+        if result.scalar_one() <= 0:
+            await session.execute(
+                delete(MessageContent)
+                .where(MessageContent.hash == digest, MessageContent.ref_count <= 0)
+                .execution_options(synchronize_session=False)
+            )
+
+    @staticmethod
+    async def _hydrate(session: AsyncSession, messages: List[Message]) -> None:
+        hashes = {
+            m.content_hash for m in messages if m.content is None and m.content_hash
+        }
+        if not hashes:
+            return
+        result = await session.execute(
+            select(MessageContent.hash, MessageContent.body).where(
+                MessageContent.hash.in_(hashes)
+            )
+        )
+        contents = dict(result.all())
+        for message in messages:
+            if message.content is None and message.content_hash in contents:
+                set_committed_value(message, "content", contents[message.content_hash])
+
+    @staticmethod
+    async def _adjust_counters(
+        session: AsyncSession, username: str, total: int, unread: int
+    ) -> None:
+        statement = insert(MessageCounter).values(
+            username=username, total=total, unread=unread
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[MessageCounter.username],
+            set_={
+                "total": MessageCounter.total + statement.excluded.total,
+                "unread": MessageCounter.unread + statement.excluded.unread,
+            },
+        )
+        await session.execute(statement)
+
+    @staticmethod
+    def _unread(is_read: Optional[bool]) -> int:
+        return 0 if is_read else 1
+
+    @staticmethod
+    def _is_counter_query(kwargs: dict) -> bool:
+        if set(kwargs) == {"username"}:
+            return True
+        return set(kwargs) == {"username", "is_read"} and kwargs["is_read"] is False
+
     @staticmethod
     def _connection_string(
         db_protocol, db_host, db_port, db_name, db_username, db_password
@@ -0,0 +1,81 @@
+import asyncio
+import contextlib
+from typing import AsyncIterator, Optional
+
+from .deadline import remaining
+
+
+class OverloadedError(Exception):
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimiter:
+    def __init__(
+        self,
+        name: str,
+        limit: int,
+        queue_size: int,
+        queue_timeout: float,
+        request_timeout: Optional[float],
+        retry_after: int = 1,
+    ):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.request_timeout = request_timeout
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.queued = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    @property
+    def saturated(self) -> bool:
+        return self.in_flight >= self.limit and self.queued >= self.queue_size
+
+    async def acquire(self) -> None:
+        if self._semaphore.locked():
+            if self.queued >= self.queue_size:
+                raise OverloadedError(
+                    f"Too many pending {self.name} requests", self.retry_after
+                )
+            timeout = self.queue_timeout
+            time_left = remaining()
+            if time_left is not None:
+                timeout = min(timeout, max(time_left, 0))
+            self.queued += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout)
+            except asyncio.TimeoutError as e:
+                raise OverloadedError(
+                    f"Timed out waiting for a {self.name} slot", self.retry_after
+                ) from e
+            finally:
+                self.queued -= 1
+        else:
+            await self._semaphore.acquire()
+        self.in_flight += 1
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    @contextlib.asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "limit": self.limit,
+            "queued": self.queued,
+            "queue_size": self.queue_size,
+            "saturated": self.saturated,
+        }
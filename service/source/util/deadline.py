@@ -0,0 +1,35 @@
+import contextlib
+import contextvars
+import time
+from typing import Iterator, Optional
+
+
+_deadline_var: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "deadline", default=None
+)
+
+
+class DeadlineExceededError(Exception):
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+
+@contextlib.contextmanager
+def deadline(timeout: Optional[float]) -> Iterator[None]:
+    current = _deadline_var.get()
+    if timeout is not None:
+        expires_at = time.monotonic() + timeout
+        current = expires_at if current is None else min(current, expires_at)
+    token = _deadline_var.set(current)
+    try:
+        yield
+    finally:
+        _deadline_var.reset(token)
+
+
+def remaining() -> Optional[float]:
+    expires_at = _deadline_var.get()
+    if expires_at is None:
+        return None
+    return expires_at - time.monotonic()
@@ -0,0 +1,107 @@
+import abc
+import collections
+import math
+import time
+
+
+class RateLimitedError(Exception):
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = retry_after
+
+
+class BucketStore(abc.ABC):
+    @abc.abstractmethod
+    async def consume(self, key: str, rate: float, capacity: int, cost: int) -> float:
+        pass
+
+
+class InMemoryBucketStore(BucketStore):
+    def __init__(self, max_buckets: int = 100_000):
+        self._max_buckets = max_buckets
+        self._buckets: collections.OrderedDict[str, list[float]] = (
+            collections.OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    async def consume(self, key: str, rate: float, capacity: int, cost: int) -> float:
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [float(capacity), now]
+            self._buckets[key] = bucket
+            if len(self._buckets) > self._max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+
+        if bucket[0] >= cost:
+            bucket[0] -= cost
+            return 0.0
+        return (cost - bucket[0]) / rate
+
+
+class RedisBucketStore(BucketStore):
+    _SCRIPT = """
+        local rate = tonumber(ARGV[1])
+        local capacity = tonumber(ARGV[2])
+        local cost = tonumber(ARGV[3])
+        local time = redis.call('TIME')
+        local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+        local tokens = tonumber(bucket[1]) or capacity
+        local updated = tonumber(bucket[2]) or now
+        tokens = math.min(capacity, tokens + (now - updated) * rate)
+        local retry_after = 0
+        if tokens >= cost then
+            tokens = tokens - cost
+        else
+            retry_after = (cost - tokens) / rate
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+        return tostring(retry_after)
+    """
+
+    def __init__(self, client):
+        self._script = client.register_script(self._SCRIPT)
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisBucketStore":
+        try:
+            import redis.asyncio
+        except ImportError as e:
+            raise RuntimeError(
+                "The redis package is required for a shared rate limit store"
+            ) from e
+        return cls(redis.asyncio.from_url(url))
+
+    async def consume(self, key: str, rate: float, capacity: int, cost: int) -> float:
+        retry_after = await self._script(keys=[key], args=[rate, capacity, cost])
+        return float(retry_after)
+
+
+class RateLimiter:
+    def __init__(self, name: str, rate: float, capacity: int, store: BucketStore):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self._store = store
+
+    async def check(self, key: str, cost: int = 1) -> None:
+        if cost > self.capacity:
+            raise ValueError(
+                f"Request cost {cost} exceeds the {self.name} rate limit capacity"
+            )
+        retry_after = await self._store.consume(
+            f"rate_limit:{self.name}:{key}", self.rate, self.capacity, cost
+        )
+        if retry_after > 0:
+            raise RateLimitedError(
+                f"Rate limit {self.name} exceeded for {key}", math.ceil(retry_after)
+            )
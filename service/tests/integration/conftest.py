@@ -1,6 +1,7 @@
 import os
 
 import pytest
+import redis
 import requests
 from requests.exceptions import ConnectionError
 
@@ -16,6 +17,13 @@ def is_responsive(url):
         return False
 
 
+def is_redis_responsive(url):
+    try:
+        return redis.Redis.from_url(url).ping()
+    except redis.exceptions.ConnectionError:
+        return False
+
+
 @pytest.fixture(scope="session")
 def docker_compose_file(pytestconfig):
     return os.path.join(
@@ -38,3 +46,25 @@ def message_repository(docker_ip, docker_services):
         db_username=os.environ["MESSENGER_DB_USERNAME"],
         db_password=os.environ["MESSENGER_DB_PASSWORD"],
     )
+
+
+@pytest.fixture(scope="session")
+def compacting_message_repository(message_repository):
+    return MessageRepository(
+        db_host="localhost",
+        db_port=int(os.environ["MESSENGER_DB_PORT"]),
+        db_name=os.environ["MESSENGER_DB_NAME"],
+        db_username=os.environ["MESSENGER_DB_USERNAME"],
+        db_password=os.environ["MESSENGER_DB_PASSWORD"],
+        compaction_threshold=64,
+    )
+
+
+@pytest.fixture(scope="session")
+def redis_url(docker_ip, docker_services):
+    port = docker_services.port_for("redis", 6379)
+    url = f"redis://{docker_ip}:{port}/0"
+    docker_services.wait_until_responsive(
+        timeout=30.0, pause=0.1, check=lambda: is_redis_responsive(url)
+    )
+    return url
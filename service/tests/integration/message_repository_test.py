@@ -1,6 +1,10 @@
 import pytest
 import asyncio
-from service.source.repository import Message
+from unittest.mock import patch
+from sqlalchemy import func, select, text
+
+from service.source.repository import Message, MessageRepository, TooManyMatchesError
+from service.source.util.deadline import DeadlineExceededError, deadline
 
 
 def test_create_message(message_repository):
@@ -58,3 +62,269 @@ def test_repository_update_message(message_repository):
             await message_repository.update_message(message2.id, foo="bar")
 
     asyncio.get_event_loop().run_until_complete(test())
+
+
+def test_repository_search_messages(message_repository):
+    async def test():
+        await message_repository.create_message(
+            Message("search.user", "Quarterly report is ready")
+        )
+        await message_repository.create_message(
+            Message("search.user", "Report the quarterly numbers")
+        )
+        await message_repository.create_message(
+            Message("search.user", "Unrelated content")
+        )
+
+        results = await message_repository.search_messages(
+            "quarterly report", 10, username="search.user"
+        )
+        assert len(results) == 2
+        assert all("uarterly" in m.content for m, _ in results)
+
+        first_page = await message_repository.search_messages(
+            "quart", 1, username="search.user"
+        )
+        last_message, last_rank = first_page[0]
+        second_page = await message_repository.search_messages(
+            "quart", 1, (last_rank, last_message.id), username="search.user"
+        )
+        assert len(second_page) == 1
+        assert second_page[0][0].id != last_message.id
+
+    asyncio.get_event_loop().run_until_complete(test())
+
+
+def test_repository_message_counters(message_repository):
+    async def test():
+        message1 = await message_repository.create_message(
+            Message("counter.user", "First")
+        )
+        message2 = await message_repository.create_message(
+            Message("counter.user", "Second")
+        )
+        await message_repository.create_message(Message("counter.user", "Third"))
+
+        await message_repository.update_message(message1.id, is_read=True)
+        await message_repository.update_message(message1.id, is_read=True)
+        await message_repository.delete_message(message2.id)
+
+        counter = await message_repository.get_message_counts("counter.user")
+        assert counter.total == 2
+        assert counter.unread == 1
+        assert await message_repository.count_messages(username="counter.user") == 2
+        assert (
+            await message_repository.count_messages(
+                username="counter.user", is_read=False
+            )
+            == 1
+        )
+
+    asyncio.get_event_loop().run_until_complete(test())
+
+
+def test_repository_stream_messages(message_repository):
+    async def test():
+        message1 = await message_repository.create_message(
+            Message("export.user", "First")
+        )
+        message2 = await message_repository.create_message(
+            Message("export.user", "Second")
+        )
+        await message_repository.create_message(Message("other.user", "Other"))
+
+        exported = [
+            m
+            async for m in message_repository.stream_messages(
+                batch_size=1, username="export.user"
+            )
+        ]
+        incremental = [
+            m
+            async for m in message_repository.stream_messages(
+                message1.id, username="export.user"
+            )
+        ]
+
+        bounded = [
+            m
+            async for m in message_repository.stream_messages(
+                until_id=message1.id, username="export.user"
+            )
+        ]
+        until_id = await message_repository.latest_message_id_before(
+            message2.created_at
+        )
+
+        assert [m.id for m in exported] == [message1.id, message2.id]
+        assert [m.id for m in incremental] == [message2.id]
+        assert [m.id for m in bounded] == [message1.id]
+        assert until_id == message1.id
+
+    asyncio.get_event_loop().run_until_complete(test())
+
+
+def test_repository_compacts_large_messages(compacting_message_repository):
+    async def test():
+        body = "Your weekly digest is ready. " * 20
+        message1 = await compacting_message_repository.create_message(
+            Message("compact.user", body)
+        )
+        message2 = await compacting_message_repository.create_message(
+            Message("other.compact.user", body)
+        )
+        message3 = await compacting_message_repository.create_message(
+            Message("compact.user", "Short message")
+        )
+
+        assert message1.content == body
+        assert message1.content_hash
+        assert message1.content_hash == message2.content_hash
+        assert message3.content_hash is None
+
+        results = await compacting_message_repository.search_messages(
+            "weekly digest", 10, username="compact.user"
+        )
+        assert [(m.id, m.content) for m, _ in results] == [(message1.id, body)]
+
+        await compacting_message_repository.delete_message(message1.id)
+        fetched = await compacting_message_repository.get_message_by_id(message2.id)
+        assert fetched.content == body
+
+        updated = await compacting_message_repository.update_message(
+            message2.id, content="Now inline"
+        )
+        assert updated.content == "Now inline"
+        assert updated.content_hash is None
+
+    asyncio.get_event_loop().run_until_complete(test())
+
+
+def test_repository_search_matches_substrings_of_compacted_messages(
+    message_repository, compacting_message_repository
+):
+    async def test():
+        body = "Invoice INV-2024-00981 is attached. " * 5
+        compacted = await compacting_message_repository.create_message(
+            Message("compact.search", body)
+        )
+        inline = await message_repository.create_message(Message("inline.search", body))
+
+        assert compacted.content_hash
+        assert inline.content_hash is None
+
+        compacted_results = await compacting_message_repository.search_messages(
+            "0098", 10, username="compact.search"
+        )
+        inline_results = await message_repository.search_messages(
+            "0098", 10, username="inline.search"
+        )
+
+        assert [(m.id, m.content) for m, _ in compacted_results] == [
+            (compacted.id, body)
+        ]
+        assert compacted_results[0][1] == pytest.approx(inline_results[0][1])
+
+    asyncio.get_event_loop().run_until_complete(test())
+
+
+def test_repository_search_pages_through_every_match(message_repository):
+    async def test():
+        for i in range(5):
+            await message_repository.create_message(
+                Message("paged.search", f"Release notes {i}")
+            )
+
+        seen, after = [], None
+        while True:
+            page = await message_repository.search_messages(
+                "release", 2, after, username="paged.search"
+            )
+            seen.extend(m.id for m, _ in page)
+            if len(page) < 2:
+                break
+            after = (page[-1][1], page[-1][0].id)
+
+        assert len(seen) == len(set(seen)) == 5
+
+    asyncio.get_event_loop().run_until_complete(test())
+
+
+def test_repository_search_rejects_too_many_matches(message_repository):
+    async def test():
+        for i in range(3):
+            await message_repository.create_message(
+                Message("broad.search", f"Broadcast {i}")
+            )
+
+        with patch.object(MessageRepository, "MAX_SEARCH_MATCHES", 2):
+            with pytest.raises(TooManyMatchesError):
+                await message_repository.search_messages(
+                    "broadcast", 10, username="broad.search"
+                )
+            results = await message_repository.search_messages(
+                "broadcast 1", 10, username="broad.search"
+            )
+
+        assert [m.content for m, _ in results] == ["Broadcast 1"]
+
+    asyncio.get_event_loop().run_until_complete(test())
+
+
+def test_repository_search_short_query_uses_full_text_only(message_repository):
+    async def test():
+        await message_repository.create_message(Message("short.search", "a b c"))
+        await message_repository.create_message(Message("short.search", "abc"))
+
+        results = await message_repository.search_messages(
+            "a", 10, username="short.search"
+        )
+
+        assert [m.content for m, _ in results] == ["a b c"]
+
+    asyncio.get_event_loop().run_until_complete(test())
+
+
+def test_repository_updates_compacted_content(compacting_message_repository):
+    async def test():
+        body = "Scheduled maintenance tonight. " * 20
+        message = await compacting_message_repository.create_message(
+            Message("compact.update.user", "Short message")
+        )
+
+        updated = await compacting_message_repository.update_message(
+            message.id, content=body, is_read=True
+        )
+        counter = await compacting_message_repository.get_message_counts(
+            "compact.update.user"
+        )
+
+        assert updated.content == body
+        assert updated.content_hash
+        assert updated.is_read
+        assert counter.unread == 0
+
+    asyncio.get_event_loop().run_until_complete(test())
+
+
+def test_repository_applies_deadline_as_statement_timeout(message_repository):
+    async def test():
+        with deadline(2.0):
+            async with message_repository._session() as session:
+                timeout = (
+                    await session.execute(text("SHOW statement_timeout"))
+                ).scalar()
+
+        assert timeout.endswith("ms")
+        assert 0 < int(timeout[:-2]) <= 2000
+
+    asyncio.get_event_loop().run_until_complete(test())
+
+
+def test_repository_raises_deadline_exceeded_on_statement_timeout(message_repository):
+    async def test():
+        with deadline(0.05), pytest.raises(DeadlineExceededError):
+            async with message_repository._session() as session:
+                await session.execute(select(func.pg_sleep(1)))
+
+    asyncio.get_event_loop().run_until_complete(test())
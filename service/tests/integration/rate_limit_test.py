@@ -0,0 +1,60 @@
+import asyncio
+import uuid
+
+import pytest
+import redis.asyncio
+
+from service.source.util.rate_limit import (
+    RateLimitedError,
+    RateLimiter,
+    RedisBucketStore,
+)
+
+
+def test_redis_store_rejects_and_refills(redis_url):
+    async def test():
+        client = redis.asyncio.from_url(redis_url)
+        key = f"user-{uuid.uuid4()}"
+        limiter = RateLimiter(
+            "test", rate=2, capacity=2, store=RedisBucketStore(client)
+        )
+
+        await limiter.check(key)
+        await limiter.check(key)
+        with pytest.raises(RateLimitedError) as e:
+            await limiter.check(key)
+        assert e.value.retry_after == 1
+        assert await client.ttl(f"rate_limit:test:{key}") == 2
+
+        await asyncio.sleep(0.5)
+        await limiter.check(key)
+        with pytest.raises(RateLimitedError):
+            await limiter.check(key)
+        await client.aclose()
+
+    asyncio.get_event_loop().run_until_complete(test())
+
+
+def test_redis_store_reports_fractional_retry_after(redis_url):
+    async def test():
+        store = RedisBucketStore.from_url(redis_url)
+        key = f"key-{uuid.uuid4()}"
+
+        assert await store.consume(key, rate=4, capacity=1, cost=1) == 0
+        assert await store.consume(key, rate=4, capacity=1, cost=1) == pytest.approx(
+            0.25, abs=0.05
+        )
+
+    asyncio.get_event_loop().run_until_complete(test())
+
+
+def test_redis_store_shares_buckets_between_clients(redis_url):
+    async def test():
+        key = f"key-{uuid.uuid4()}"
+        first = RedisBucketStore.from_url(redis_url)
+        second = RedisBucketStore.from_url(redis_url)
+
+        assert await first.consume(key, rate=1, capacity=2, cost=2) == 0
+        assert await second.consume(key, rate=1, capacity=2, cost=1) > 0
+
+    asyncio.get_event_loop().run_until_complete(test())
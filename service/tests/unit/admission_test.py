@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from service.source.util.admission import ConcurrencyLimiter, OverloadedError
+from service.source.util.deadline import deadline, remaining
+
+
+def test_limiter_rejects_when_queue_is_full():
+    async def test():
+        limiter = ConcurrencyLimiter(
+            "test", limit=1, queue_size=0, queue_timeout=1.0, request_timeout=None
+        )
+        async with limiter.admit():
+            assert limiter.saturated
+            with pytest.raises(OverloadedError):
+                await limiter.acquire()
+        assert limiter.in_flight == 0
+
+    asyncio.run(test())
+
+
+def test_limiter_queued_request_times_out():
+    async def test():
+        limiter = ConcurrencyLimiter(
+            "test", limit=1, queue_size=1, queue_timeout=0.01, request_timeout=None
+        )
+        async with limiter.admit():
+            with pytest.raises(OverloadedError):
+                await limiter.acquire()
+            assert limiter.queued == 0
+
+    asyncio.run(test())
+
+
+def test_limiter_queued_request_is_admitted_on_release():
+    async def test():
+        limiter = ConcurrencyLimiter(
+            "test", limit=1, queue_size=1, queue_timeout=1.0, request_timeout=None
+        )
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.queued == 1
+
+        limiter.release()
+        await waiter
+        assert limiter.in_flight == 1
+        assert limiter.queued == 0
+
+    asyncio.run(test())
+
+
+def test_nested_deadline_only_shortens():
+    assert remaining() is None
+    with deadline(10.0):
+        with deadline(60.0):
+            assert remaining() <= 10.0
+        with deadline(None):
+            assert remaining() <= 10.0
+    assert remaining() is None
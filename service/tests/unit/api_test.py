@@ -1,10 +1,19 @@
+import csv
+import io
+import json
+
 import pytest
 
-from unittest.mock import patch, AsyncMock
+from datetime import datetime
+from unittest.mock import patch, AsyncMock, MagicMock
 from fastapi.testclient import TestClient
 
+from service.source import api
 from service.source.api import app
-from service.source.repository import Message
+from service.source.repository import Message, MessageCounter, TooManyMatchesError
+from service.source.util.admission import OverloadedError
+from service.source.util.deadline import DeadlineExceededError
+from service.source.util.rate_limit import InMemoryBucketStore
 
 
 @pytest.fixture
@@ -55,3 +64,317 @@ def test_post_message_value_error(message_repository, client):
 
     assert response.status_code == 400
     assert data == {"detail": "Bad request"}
+
+
+@patch("service.source.api.message_repository")
+def test_search_messages_returns_next_cursor(message_repository, client):
+    message = Message(username="john.doe", content="Hello, world!")
+    message.id = 7
+
+    message_repository.search_messages = AsyncMock(return_value=[(message, 0.25)])
+
+    response = client.get("/message/search", params={"q": "hello", "size": 1})
+    data = response.json()
+
+    assert response.status_code == 200
+    assert [m["message_id"] for m in data["messages"]] == [7]
+    assert data["next_cursor"]
+
+    client.get("/message/search", params={"q": "hello", "cursor": data["next_cursor"]})
+    assert message_repository.search_messages.call_args.args[2] == (0.25, 7)
+
+
+@patch("service.source.api.message_repository")
+def test_search_messages_malformed_cursor(message_repository, client):
+    message_repository.search_messages = AsyncMock(return_value=[])
+
+    response = client.get("/message/search", params={"q": "hello", "cursor": "%%%"})
+
+    assert response.status_code == 422
+    message_repository.search_messages.assert_not_called()
+
+
+@patch("service.source.api.message_repository")
+def test_search_messages_too_many_matches(message_repository, client):
+    message_repository.search_messages = AsyncMock(
+        side_effect=TooManyMatchesError("Search matched more than 10000 messages")
+    )
+
+    response = client.get("/message/search", params={"q": "hello"})
+
+    assert response.status_code == 422
+    assert response.json() == {
+        "detail": "Search matched more than 10000 messages; "
+        "refine the query or filter by username"
+    }
+
+
+@patch("service.source.api.message_repository")
+def test_get_message_counts(message_repository, client):
+    counter = MessageCounter(username="john.doe", total=5, unread=2)
+    message_repository.get_message_counts = AsyncMock(return_value=counter)
+
+    response = client.get("/user/john.doe/counts")
+
+    assert response.status_code == 200
+    assert response.json() == {"username": "john.doe", "total": 5, "unread": 2}
+
+
+@patch("service.source.api.message_repository")
+def test_get_message_counts_unknown_user(message_repository, client):
+    message_repository.get_message_counts = AsyncMock(return_value=None)
+
+    response = client.get("/user/nobody/counts")
+
+    assert response.status_code == 200
+    assert response.json() == {"username": "nobody", "total": 0, "unread": 0}
+
+
+def _stream(*messages):
+    async def stream(*args, **kwargs):
+        for message in messages:
+            yield message
+
+    return stream
+
+
+@patch("service.source.api.message_repository")
+def test_export_messages_ndjson(message_repository, client):
+    message1 = Message(username="john.doe", content="Hello, world!")
+    message1.id = 1
+    message2 = Message(username="john.doe", content="Goodbye, world!")
+    message2.id = 2
+    message_repository.stream_messages = _stream(message1, message2)
+    message_repository.latest_message_id_before = AsyncMock(return_value=2)
+
+    response = client.get("/message/export", params={"username": "john.doe"})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [line["message_id"] for line in lines] == [1, 2]
+    assert lines[1]["content"] == "Goodbye, world!"
+
+
+@patch("service.source.api.message_repository")
+def test_export_messages_csv(message_repository, client):
+    message = Message(username="john.doe", content='Hello, "world"!')
+    message.id = 1
+    message_repository.stream_messages = _stream(message)
+    message_repository.latest_message_id_before = AsyncMock(return_value=2)
+
+    response = client.get(
+        "/message/export", params={"username": "john.doe", "format": "csv"}
+    )
+    rows = list(csv.reader(io.StringIO(response.text)))
+
+    assert response.status_code == 200
+    assert rows[0] == ["message_id", "username", "content", "is_read", "created_at"]
+    assert rows[1][:4] == ["1", "john.doe", 'Hello, "world"!', "False"]
+
+
+@pytest.fixture
+def pool_stats():
+    return {"size": 5, "checked_out": 0, "overflow": -5}
+
+
+@patch("service.source.api.message_repository")
+def test_health_reports_ok(message_repository, client, pool_stats):
+    message_repository.pool_stats.return_value = pool_stats
+
+    response = client.get("/health")
+    data = response.json()
+
+    assert response.status_code == 200
+    assert data["status"] == "ok"
+    assert set(data["limiters"]) == {"read", "write", "export"}
+    assert data["pool"] == pool_stats
+
+
+@patch("service.source.api.message_repository")
+def test_health_reports_saturation(message_repository, client, pool_stats):
+    message_repository.pool_stats.return_value = pool_stats
+    limiter = api.read_limiter
+
+    with patch.object(limiter, "in_flight", limiter.limit), patch.object(
+        limiter, "queued", limiter.queue_size
+    ):
+        response = client.get("/health")
+    data = response.json()
+
+    assert response.status_code == 503
+    assert data["status"] == "saturated"
+    assert data["limiters"]["read"] == {
+        "in_flight": limiter.limit,
+        "limit": limiter.limit,
+        "queued": limiter.queue_size,
+        "queue_size": limiter.queue_size,
+        "saturated": True,
+    }
+    assert data["limiters"]["write"]["saturated"] is False
+
+
+@patch("service.source.api.message_repository")
+def test_health_ignores_running_exports(message_repository, client, pool_stats):
+    message_repository.pool_stats.return_value = pool_stats
+    limiter = api.export_limiter
+
+    with patch.object(limiter, "in_flight", limiter.limit):
+        response = client.get("/health")
+    data = response.json()
+
+    assert response.status_code == 200
+    assert data["status"] == "ok"
+    assert data["limiters"]["export"]["saturated"] is True
+
+
+@patch("service.source.api.message_repository")
+def test_post_message_rejected_when_overloaded(message_repository, client):
+    message_repository.create_message = AsyncMock()
+
+    with patch.object(
+        api.write_limiter,
+        "acquire",
+        AsyncMock(side_effect=OverloadedError("Too many pending write requests", 1)),
+    ):
+        response = client.post(
+            "/message/", json={"username": "john.doe", "content": "Hello, world!"}
+        )
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    message_repository.create_message.assert_not_called()
+
+
+@patch("service.source.api.message_repository")
+def test_get_message_deadline_exceeded(message_repository, client):
+    message_repository.get_message_by_id = AsyncMock(
+        side_effect=DeadlineExceededError("Request deadline exceeded")
+    )
+
+    response = client.get("/message/1", headers={"X-Request-Timeout-Ms": "50"})
+
+    assert response.status_code == 504
+    assert response.json() == {"detail": "Request timed out"}
+
+
+@patch("service.source.api.message_repository")
+def test_post_message_rate_limited_per_username(message_repository, client):
+    message_repository.create_message = AsyncMock()
+
+    with patch.object(
+        api.create_user_rate_limiter,
+        "_store",
+        InMemoryBucketStore(),
+    ), patch.object(api.create_user_rate_limiter, "capacity", 1):
+        payload = {"username": "noisy.producer", "content": "Hello, world!"}
+        client.post("/message/", json=payload)
+        response = client.post("/message/", json=payload)
+
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+    assert message_repository.create_message.call_count == 1
+
+
+@patch("service.source.api.message_repository")
+def test_post_message_rate_limited_before_admission(message_repository, client):
+    message_repository.create_message = AsyncMock()
+    payload = {"username": "noisy.producer", "content": "Hello, world!"}
+
+    with patch.object(
+        api.create_user_rate_limiter, "_store", InMemoryBucketStore()
+    ), patch.object(api.create_user_rate_limiter, "capacity", 1):
+        client.post("/message/", json=payload)
+        with patch.object(api.write_limiter, "acquire", AsyncMock()) as acquire:
+            response = client.post("/message/", json=payload)
+
+    assert response.status_code == 429
+    acquire.assert_not_awaited()
+    assert message_repository.create_message.call_count == 1
+
+
+@patch("service.source.api.message_repository")
+def test_delete_messages_rate_limited_by_batch_size(message_repository, client):
+    message_repository.delete_message = AsyncMock(return_value=True)
+
+    with patch.object(api.delete_client_rate_limiter, "_store", InMemoryBucketStore()):
+        client.delete("/message/", params={"message_ids": list(range(100))})
+        response = client.delete("/message/", params={"message_ids": [1]})
+
+    assert response.status_code == 429
+    assert message_repository.delete_message.call_count == 100
+
+
+@patch("service.source.api.message_repository")
+def test_delete_messages_rejects_batch_above_capacity(message_repository, client):
+    message_repository.delete_message = AsyncMock(return_value=True)
+
+    response = client.delete("/message/", params={"message_ids": list(range(101))})
+
+    assert response.status_code == 422
+    message_repository.delete_message.assert_not_called()
+
+
+@patch("service.source.api.message_repository")
+def test_export_messages_escapes_filename(message_repository, client):
+    message_repository.stream_messages = _stream()
+    message_repository.latest_message_id_before = AsyncMock(return_value=2)
+
+    response = client.get(
+        "/message/export",
+        params={"username": 'evil"\r\nX-Injected: 1', "format": "csv"},
+    )
+
+    assert response.status_code == 200
+    assert "x-injected" not in response.headers
+    assert response.headers["content-disposition"] == (
+        'attachment; filename="export.csv"; '
+        "filename*=UTF-8''evil%22%0D%0AX-Injected%3A%201.csv"
+    )
+
+
+@patch("service.source.api.message_repository")
+def test_export_releases_slot_when_stream_fails(message_repository, client):
+    message = Message(username="john.doe", content="Hello, world!")
+    message.id = 1
+
+    async def failing_stream(*args, **kwargs):
+        yield message
+        raise RuntimeError("Statement timed out")
+
+    message_repository.stream_messages = failing_stream
+    message_repository.latest_message_id_before = AsyncMock(return_value=2)
+
+    for _ in range(api.export_limiter.limit + 1):
+        client.get("/message/export", params={"username": "john.doe"})
+
+    assert api.export_limiter.in_flight == 0
+
+
+@patch("service.source.api.message_repository")
+def test_export_messages_stops_at_settled_id(message_repository, client):
+    stream = MagicMock(side_effect=_stream())
+    message_repository.stream_messages = stream
+    message_repository.latest_message_id_before = AsyncMock(return_value=41)
+
+    response = client.get(
+        "/message/export", params={"username": "john.doe", "after_id": 7}
+    )
+
+    assert response.status_code == 200
+    assert response.headers["X-Export-Until-Id"] == "41"
+    assert stream.call_args.args == (7, 41)
+    (cutoff,) = message_repository.latest_message_id_before.call_args.args
+    assert cutoff <= datetime.now() - api.EXPORT_LAG
+
+
+@patch("service.source.api.message_repository")
+def test_export_releases_slot_when_bound_query_fails(message_repository, client):
+    message_repository.latest_message_id_before = AsyncMock(
+        side_effect=RuntimeError("Database unavailable")
+    )
+
+    response = client.get("/message/export", params={"username": "john.doe"})
+
+    assert response.status_code == 500
+    assert api.export_limiter.in_flight == 0
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+from service.source.util.rate_limit import (
+    InMemoryBucketStore,
+    RateLimitedError,
+    RateLimiter,
+)
+
+
+def test_rate_limiter_rejects_when_bucket_is_empty():
+    async def test():
+        limiter = RateLimiter("test", rate=1, capacity=2, store=InMemoryBucketStore())
+        await limiter.check("john.doe")
+        await limiter.check("john.doe")
+        with pytest.raises(RateLimitedError) as e:
+            await limiter.check("john.doe")
+        assert e.value.retry_after == 1
+        await limiter.check("jane.doe")
+
+    asyncio.run(test())
+
+
+def test_rate_limiter_rejects_cost_above_capacity():
+    async def test():
+        limiter = RateLimiter("test", rate=1, capacity=5, store=InMemoryBucketStore())
+        with pytest.raises(ValueError):
+            await limiter.check("john.doe", cost=50)
+        await limiter.check("john.doe", cost=5)
+
+    asyncio.run(test())
+
+
+def test_bucket_refills_over_time():
+    async def test():
+        store = InMemoryBucketStore()
+        assert await store.consume("key", rate=1000, capacity=1, cost=1) == 0
+        assert await store.consume("key", rate=1000, capacity=1, cost=1) > 0
+        await asyncio.sleep(0.01)
+        assert await store.consume("key", rate=1000, capacity=1, cost=1) == 0
+
+    asyncio.run(test())
+
+
+def test_store_evicts_least_recently_used_bucket():
+    async def test():
+        store = InMemoryBucketStore(max_buckets=2)
+        await store.consume("a", rate=1, capacity=1, cost=1)
+        await store.consume("b", rate=1, capacity=1, cost=1)
+        await store.consume("a", rate=1, capacity=1, cost=0)
+        await store.consume("c", rate=1, capacity=1, cost=1)
+
+        assert len(store) == 2
+        assert await store.consume("a", rate=1, capacity=1, cost=1) > 0
+        assert await store.consume("b", rate=1, capacity=1, cost=1) == 0
+
+    asyncio.run(test())